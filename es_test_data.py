@@ -10,7 +10,11 @@ import datetime
 import csv
 import os
 import math
+import gzip
+import queue
+import threading
 
+import numpy as np
 import tornado.gen
 import tornado.httpclient
 import tornado.ioloop
@@ -28,12 +32,20 @@ last_speed = 0.0
 last_interval = 0.0
 last_time = 0
 last_string =""
+_vector_centroids = {}
+_vector_batches = {}
 
 byte_range = (-128, 127)
 short_range = (-32768, 32767)
 integer_range = (-2**31, 2**31-1)
 long_range = (-2**63, 2**63-1)
 
+vector_similarities = ("cosine", "dot_product", "l2_norm", "max_inner_product")
+vector_precision = 6
+
+out_file_buffer_size = 1024 * 1024
+out_file_put_timeout = 10
+
 def delete_index(idx_name):
     try:
         url = "%s/%s" % (tornado.options.options.es_url, idx_name)
@@ -85,6 +97,98 @@ def upload_batch(upload_data_txt):
     took = int(result['took'])
     logging.info("Upload: %s - upload took: %5dms, total docs uploaded: %7d" % (res_txt, took, upload_data_count))
 
+class OutFileWriter(object):
+    """
+    Writes chunks of pre-serialized documents to `path` from a dedicated thread
+    so slow disks don't stall the IOLoop. `write` blocks once `queue_size`
+    chunks are pending (logging a warning every `out_file_put_timeout` seconds
+    it waits), the file is fsynced when closed. A failed write ends the run.
+    """
+
+    def __init__(self, path, compress=False, compress_level=1, queue_size=16):
+        self._raw = open(path, "wb", buffering=out_file_buffer_size)
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=compress_level) if compress else self._raw
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="out_file_writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if self._error:
+                continue
+            try:
+                self._file.write(chunk.encode("utf-8"))
+            except Exception as ex:
+                self._error = ex
+
+    def _check_error(self):
+        if self._error:
+            logging.error("writing out_file %s failed, error: %s" % (self._raw.name, self._error))
+            exit(1)
+
+    def write(self, chunk):
+        self._check_error()
+        if not chunk:
+            return
+        while True:
+            try:
+                self._queue.put(chunk, timeout=out_file_put_timeout)
+                return
+            except queue.Full:
+                self._check_error()
+                logging.warning("out_file writer made no progress for %d seconds with %d batches queued, waiting" % (out_file_put_timeout, self._queue.qsize()))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            if self._file is not self._raw:
+                self._file.close()
+            self._raw.flush()
+            os.fsync(self._raw.fileno())
+        except Exception as ex:
+            self._error = self._error or ex
+        finally:
+            try:
+                self._raw.close()
+            except Exception as ex:
+                self._error = self._error or ex
+        self._check_error()
+
+def get_vector_params(split_f):
+    dims = 128 if len(split_f) < 3 else int(split_f[2])
+    similarity = "cosine" if len(split_f) < 4 else split_f[3]
+    num_centroids = 0 if len(split_f) < 5 else int(split_f[4])
+    spread = 0.1 if len(split_f) < 6 else float(split_f[5])
+    m = 16 if len(split_f) < 7 else int(split_f[6])
+    ef_construction = 100 if len(split_f) < 8 else int(split_f[7])
+
+    if dims <= 0:
+        logging.error("invalid vector dims %d, must be greater than 0" % dims)
+        exit(1)
+    if similarity not in vector_similarities:
+        logging.error("invalid vector similarity '%s', valid settings are %s" % (similarity, ", ".join(vector_similarities)))
+        exit(1)
+    if num_centroids < 0:
+        logging.error("invalid vector num_centroids %d, must be 0 or greater" % num_centroids)
+        exit(1)
+    if spread < 0:
+        logging.error("invalid vector spread %s, must be 0 or greater" % spread)
+        exit(1)
+    if m <= 0:
+        logging.error("invalid vector m %d, must be greater than 0" % m)
+        exit(1)
+    if ef_construction <= 0:
+        logging.error("invalid vector ef_construction %d, must be greater than 0" % ef_construction)
+        exit(1)
+
+    return dims, similarity, num_centroids, spread, m, ef_construction
+
 def get_mapping_for_format(format):
     split_f = format.split(":")
     if not split_f:
@@ -137,6 +241,19 @@ def get_mapping_for_format(format):
     elif field_type in ("ellipse","ellipsecities","path"):
         field_mapping["type"] = "geo_shape"
 
+    elif field_type == "vector":
+        dims, similarity, _, _, m, ef_construction = get_vector_params(split_f)
+
+        field_mapping["type"] = "dense_vector"
+        field_mapping["dims"] = dims
+        field_mapping["index"] = True
+        field_mapping["similarity"] = similarity
+        field_mapping["index_options"] = {
+            "type": "hnsw",
+            "m": m,
+            "ef_construction": ef_construction
+        }
+
     else:
         field_mapping["type"] = field_type
 
@@ -408,6 +525,15 @@ def get_data_for_format(format,doc_num):
             "coordinates": points
         }
 
+    elif field_type == "vector":
+        dims, _, num_centroids, spread, _, _ = get_vector_params(split_f)
+
+        batch = _vector_batches.get(field_name)
+        if not batch:
+            batch = generate_vector_batch(field_name, dims, num_centroids, spread, tornado.options.options.batch_size)
+            _vector_batches[field_name] = batch
+        return_val = batch.pop()
+
     return field_name, return_val
 
 def generate_float(min, max):
@@ -545,6 +671,31 @@ def generate_next_geo_point(last_geo_point,last_heading,distance):
     if y1>90: y1=90
     return [x1,y1]
 
+def generate_vector_batch(field_name, dims, num_centroids, spread, count):
+    """
+    Generate `count` unit length vectors at once, returned as a list of lists
+    rounded to `vector_precision` decimals to keep the JSON output compact.
+    If `num_centroids` is set the vectors are clustered around that many random
+    centroids (kept per field) with a gaussian noise whose expected length is
+    `spread` relative to the unit length centroid, otherwise they are uniformly
+    distributed on the unit sphere.
+    """
+    if num_centroids > 0:
+        centroids = _vector_centroids.get(field_name)
+        if centroids is None:
+            centroids = np.random.standard_normal((num_centroids, dims))
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+            _vector_centroids[field_name] = centroids
+        vectors = centroids[np.random.randint(0, num_centroids, count)]
+        vectors = vectors + np.random.normal(0.0, spread / math.sqrt(dims), (count, dims))
+    else:
+        vectors = np.random.standard_normal((count, dims))
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+    return np.round(vectors, vector_precision).tolist()
+
 
 def generate_mapping(format):
     properties = {}
@@ -610,7 +761,16 @@ def generate_test_data():
         set_index_refresh("-1")
 
     if tornado.options.options.out_file:
-        out_file = open(tornado.options.options.out_file, "w")
+        if tornado.options.options.out_file_queue_size <= 0:
+            logging.error("invalid out_file_queue_size %d, must be greater than 0" % tornado.options.options.out_file_queue_size)
+            exit(1)
+        if not 0 <= tornado.options.options.out_file_compress_level <= 9:
+            logging.error("invalid out_file_compress_level %d, valid settings are 0 to 9" % tornado.options.options.out_file_compress_level)
+            exit(1)
+        out_file = OutFileWriter(tornado.options.options.out_file,
+                                 compress=tornado.options.options.out_file_compress,
+                                 compress_level=tornado.options.options.out_file_compress_level,
+                                 queue_size=tornado.options.options.out_file_queue_size)
     else:
         out_file = None
 
@@ -625,6 +785,7 @@ def generate_test_data():
 
     ts_start = int(time.time())
     upload_data_txt = ""
+    out_data_txt = ""
     total_uploaded = 0
 
     logging.info("Generating %d docs, upload batch size is %d" % (tornado.options.options.count,
@@ -632,24 +793,31 @@ def generate_test_data():
     for num in range(0, tornado.options.options.count):
 
         item = generate_random_doc(format,num)
+        item_txt = json.dumps(item, separators=(",", ":"))
 
         if out_file:
-            out_file.write("%s\n" % json.dumps(item))
+            out_data_txt += item_txt + "\n"
 
-        cmd = {'index': {'_index': tornado.options.options.index_name,
-                         '_type': tornado.options.options.index_type}}
+        cmd = {'index': {'_index': tornado.options.options.index_name}}
+        if tornado.options.options.index_type:
+            cmd['index']['_type'] = tornado.options.options.index_type
         if '_id' in item:
             cmd['index']['_id'] = item['_id']
 
-        upload_data_txt += json.dumps(cmd) + "\n"
-        upload_data_txt += json.dumps(item) + "\n"
+        upload_data_txt += json.dumps(cmd, separators=(",", ":")) + "\n"
+        upload_data_txt += item_txt + "\n"
         upload_data_count += 1
 
         if upload_data_count % tornado.options.options.batch_size == 0:
+            if out_file:
+                out_file.write(out_data_txt)
+                out_data_txt = ""
             yield upload_batch(upload_data_txt)
             upload_data_txt = ""
 
     # upload remaining items in `upload_data_txt`
+    if out_file:
+        out_file.write(out_data_txt)
     if upload_data_txt:
         yield upload_batch(upload_data_txt)
 
@@ -667,7 +835,7 @@ def generate_test_data():
 if __name__ == '__main__':
     tornado.options.define("es_url", type=str, default='http://localhost:9200/', help="URL of your Elasticsearch node")
     tornado.options.define("index_name", type=str, default='test_data', help="Name of the index to store your messages")
-    tornado.options.define("index_type", type=str, default='_doc', help="Type")
+    tornado.options.define("index_type", type=str, default=None, help="Type to send with each bulk action, only needed for Elasticsearch versions before 7. None is default")
     tornado.options.define("batch_size", type=int, default=1000, help="Elasticsearch bulk index batch size")
     tornado.options.define("num_of_shards", type=int, default=2, help="Number of shards for ES index")
     tornado.options.define("http_upload_timeout", type=int, default=3, help="Timeout in seconds when uploading data")
@@ -678,6 +846,9 @@ if __name__ == '__main__':
     tornado.options.define("dynamic_index", type=bool, default=False, help="Use dynamic index instead of a strict mapping")
     tornado.options.define("set_refresh", type=bool, default=False, help="Set refresh rate to -1 before starting the upload")
     tornado.options.define("out_file", type=str, default=False, help="If set, write test data to out_file as well.")
+    tornado.options.define("out_file_compress", type=bool, default=False, help="If set, gzip compress the data written to out_file")
+    tornado.options.define("out_file_compress_level", type=int, default=1, help="gzip compression level (0-9) used with out_file_compress, 1 is fastest")
+    tornado.options.define("out_file_queue_size", type=int, default=16, help="Number of batches that may be queued for writing to out_file before generating blocks")
     tornado.options.define("id_type", type=str, default=None, help="Type of 'id' to use for the docs, valid settings are int and uuid4, None is default")
     tornado.options.define("dict_file", type=str, default=None, help="Name of dictionary file to use")
     tornado.options.define("cities_file", type=str, default="worldcities.csv", help="Name of dictionary file to use")